@@ -1,7 +1,15 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
+import functools
+import hashlib
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Optional
 import io
 
 # ---------------------------
@@ -17,9 +25,80 @@ st.set_page_config(page_title="Grat.io - Cálculo de Gratificação", layout="wi
 # Helpers de banco de dados
 # ---------------------------
 
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    # conexão única reaproveitada entre reruns e sessões; transações explícitas
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@st.cache_resource
+def get_db_lock() -> threading.Lock:
+    # a conexão é compartilhada: leituras também esperam, para nunca verem
+    # linhas de uma transação ainda aberta em outra sessão
+    return threading.Lock()
+
+
+@contextmanager
+def reading():
+    with get_db_lock():
+        yield get_conn()
+
+
+@contextmanager
+def transaction():
+    conn = get_conn()
+    with get_db_lock():
+        conn.execute("BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            # sem isso a conexão compartilhada ficaria presa numa transação aberta
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+
+# Colunas das tabelas que tinham 'period' como texto 'YYYY-MM' em versões antigas
+_LEGACY_PERIOD_TABLES = {
+    "atendimentos": ["id", "profissional_id", "profissional", "data", "tipo", "quantidade", "source_file", "period"],
+    "descontos": ["id", "profissional_id", "period", "campo", "valor"],
+}
+
+
+def rename_legacy_period_tables(cur) -> list:
+    # tabelas com period TEXT são renomeadas para serem recriadas com period INTEGER
+    legacy = []
+    for table in _LEGACY_PERIOD_TABLES:
+        col_types = {r[1]: r[2] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+        if col_types.get("period", "").upper() == "TEXT":
+            cur.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            legacy.append(table)
+    if legacy:
+        # os índices acompanham a tabela renomeada; serão recriados
+        cur.execute("DROP INDEX IF EXISTS idx_atend_period_prof")
+        cur.execute("DROP INDEX IF EXISTS idx_desc_prof_period")
+    return legacy
+
+
+def copy_legacy_period_table(cur, table: str):
+    cols = _LEGACY_PERIOD_TABLES[table]
+    period_int = (
+        "CASE WHEN period GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' "
+        "THEN CAST(substr(period, 1, 4) AS INTEGER) * 12 + CAST(substr(period, 6, 2) AS INTEGER) - 1 END"
+    )
+    select_cols = [period_int if c == "period" else c for c in cols]
+    cur.execute(f"INSERT INTO {table} ({', '.join(cols)}) SELECT {', '.join(select_cols)} FROM {table}_legacy")
+    cur.execute(f"DROP TABLE {table}_legacy")
+
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
+    with transaction() as conn:
         cur = conn.cursor()
+        legacy = rename_legacy_period_tables(cur)
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS atendimentos (
@@ -30,7 +109,7 @@ def init_db():
                 tipo TEXT,
                 quantidade INTEGER,
                 source_file TEXT,
-                period TEXT
+                period INTEGER
             )
             """
         )
@@ -39,65 +118,137 @@ def init_db():
             CREATE TABLE IF NOT EXISTS descontos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 profissional_id TEXT,
-                period TEXT,
+                period INTEGER,
                 campo TEXT,
                 valor INTEGER,
                 UNIQUE(profissional_id, period, campo)
             )
             """
         )
-        conn.commit()
+        # consultas sempre filtram por período e profissional
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_atend_period_prof ON atendimentos(period, profissional_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_desc_prof_period ON descontos(profissional_id, period)")
+        # arquivos já importados (hash do conteúdo), para não reprocessar reenvios
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                hash TEXT PRIMARY KEY,
+                name TEXT,
+                ts TEXT
+            )
+            """
+        )
+        for table in legacy:
+            copy_legacy_period_table(cur, table)
 
 
-def save_atendimentos(df: pd.DataFrame, source_file: str = "uploaded"):
-    if df is None or df.empty:
+def save_atendimentos(df: pd.DataFrame, source_file: str = "uploaded", uploads: Optional[list] = None):
+    # uploads: pares (hash, nome) gravados na mesma transação que as linhas
+    has_rows = df is not None and not df.empty
+    if not has_rows and not uploads:
         return
-    # normalize data types
-    df_to_save = df.copy()
-    if "data" in df_to_save.columns:
-        df_to_save["data"] = pd.to_datetime(df_to_save["data"], errors="coerce").dt.strftime("%Y-%m-%d")
-    df_to_save["source_file"] = getattr(df, "source_file", source_file) if "source_file" not in df_to_save.columns else df_to_save["source_file"]
-    with sqlite3.connect(DB_PATH) as conn:
-        df_to_save.to_sql("atendimentos", conn, if_exists="append", index=False)
+    if has_rows:
+        # normalize data types (assign cria um novo frame que compartilha as demais colunas)
+        if "data" in df.columns:
+            df = df.assign(data=pd.to_datetime(df["data"], errors="coerce").dt.strftime("%Y-%m-%d"))
+        if "source_file" not in df.columns:
+            df = df.assign(source_file=source_file)
+        cols = list(df.columns)
+        # valores nativos do Python (sqlite3 não aceita tipos numpy) e NaN -> NULL
+        rows = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    with transaction() as conn:
+        if has_rows:
+            conn.executemany(
+                f"INSERT INTO atendimentos ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                rows,
+            )
+        if uploads:
+            ts = datetime.now().isoformat(timespec="seconds")
+            conn.executemany("INSERT OR IGNORE INTO uploads (hash, name, ts) VALUES (?, ?, ?)", [(h, name, ts) for h, name in uploads])
+    if has_rows:
+        load_atendimentos_cached.clear()
 
 
-def save_descontos(profissional_id: str, period: str, descontos_dict: dict):
+def save_descontos(profissional_id: str, period: int, descontos_dict: dict):
     if not descontos_dict:
         return
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        for campo, valor in descontos_dict.items():
-            # inserir ou substituir pelo par (profissional_id, period, campo)
-            cur.execute(
-                "INSERT OR REPLACE INTO descontos (profissional_id, period, campo, valor) VALUES (?, ?, ?, ?)",
-                (profissional_id, period, campo, int(valor)),
-            )
-        conn.commit()
+    rows = [(profissional_id, period, campo, int(valor)) for campo, valor in descontos_dict.items()]
+    with transaction() as conn:
+        # inserir ou substituir pelo par (profissional_id, period, campo)
+        conn.executemany(
+            "INSERT OR REPLACE INTO descontos (profissional_id, period, campo, valor) VALUES (?, ?, ?, ?)",
+            rows,
+        )
 
 
-def load_atendimentos() -> pd.DataFrame:
-    with sqlite3.connect(DB_PATH) as conn:
-        try:
-            df = pd.read_sql_query("SELECT * FROM atendimentos", conn)
-        except Exception:
-            df = pd.DataFrame(columns=["id", "profissional_id", "profissional", "data", "tipo", "quantidade", "source_file", "period"])
+def load_atendimentos(period: Optional[int] = None) -> pd.DataFrame:
+    try:
+        with reading() as conn:
+            if period is None:
+                df = pd.read_sql_query("SELECT * FROM atendimentos", conn)
+            else:
+                df = pd.read_sql_query("SELECT * FROM atendimentos WHERE period=?", conn, params=(period,))
+    except Exception:
+        df = pd.DataFrame(columns=["id", "profissional_id", "profissional", "data", "tipo", "quantidade", "source_file", "period"])
     if not df.empty:
         # ensure types
         if "quantidade" in df.columns:
-            df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").fillna(0).astype(int)
+            # int32 só economiza memória da coluna (np.bincount no resumo usa pesos float64)
+            df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").fillna(0).astype(np.int32)
         if "data" in df.columns:
-            df["data"] = pd.to_datetime(df["data"], errors="coerce")
+            # datas gravadas em ISO (save_atendimentos normaliza para YYYY-MM-DD)
+            df["data"] = pd.to_datetime(df["data"], format="ISO8601", errors="coerce")
     return df
 
 
-def load_descontos(profissional_id: str, period: str) -> dict:
-    with sqlite3.connect(DB_PATH) as conn:
+def load_periods() -> list:
+    # inclui None quando houver registros sem período válido
+    with reading() as conn:
+        rows = conn.execute("SELECT DISTINCT period FROM atendimentos ORDER BY period").fetchall()
+    return [r[0] for r in rows]
+
+
+def get_db_mtime() -> float:
+    # com WAL as gravações vão primeiro para o arquivo -wal
+    paths = [DB_PATH, DB_PATH + "-wal"]
+    return max(os.path.getmtime(p) for p in paths if os.path.exists(p))
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_atendimentos_cached(db_mtime: float, period: Optional[int] = None) -> pd.DataFrame:
+    # db_mtime só compõe a chave do cache: qualquer gravação no banco o invalida
+    # (max_entries descarta as entradas antigas deixadas por cada gravação)
+    return load_atendimentos(period)
+
+
+def load_descontos(profissional_id: str, period: int) -> dict:
+    with reading() as conn:
         cur = conn.cursor()
         cur.execute("SELECT campo, valor FROM descontos WHERE profissional_id=? AND period=?", (profissional_id, period))
         rows = cur.fetchall()
     return {r[0]: r[1] for r in rows} if rows else {}
 
 
+def load_descontos_sum_by_period(period: int) -> dict:
+    # total de descontos de todos os profissionais do período numa só consulta
+    with reading() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT profissional_id, SUM(valor) FROM descontos WHERE period=? GROUP BY profissional_id", (period,))
+        rows = cur.fetchall()
+    return {r[0]: r[1] for r in rows}
+
+
+def file_hash(file) -> str:
+    return hashlib.blake2b(file.getvalue(), digest_size=16).hexdigest()
+
+
+def is_upload_processed(hash_: str) -> bool:
+    with reading() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM uploads WHERE hash=?", (hash_,))
+        return cur.fetchone() is not None
+
+
 # ---------------------------
 # Parser de relatórios (placeholder)
 # - Se .xlsx tenta ler colunas padrão
@@ -105,6 +256,25 @@ def load_descontos(profissional_id: str, period: str) -> dict:
 # ---------------------------
 
 
+def period_from_dates(datas: pd.Series) -> pd.Series:
+    # período como inteiro ano*12 + (mês-1): filtrar/indexar inteiros é mais barato que texto
+    return (datas.dt.year * 12 + datas.dt.month - 1).astype("Int64")
+
+
+def format_period(period: int) -> str:
+    return f"{period // 12:04d}-{period % 12 + 1:02d}"
+
+
+def parse_dates(valores: pd.Series) -> pd.Series:
+    # ISO (YYYY-MM-DD) primeiro; só o que falhar é lido como dd/mm/aaaa
+    datas = pd.to_datetime(valores, format="ISO8601", errors="coerce", cache=True)
+    faltando = datas.isna() & valores.notna()
+    if faltando.any():
+        resto = pd.to_datetime(valores[faltando], format="mixed", dayfirst=True, errors="coerce", cache=True)
+        datas = datas.combine_first(resto)
+    return datas
+
+
 def try_find_column(df: pd.DataFrame, candidates):
     cols = list(df.columns)
     cols_low = [c.lower() for c in cols]
@@ -116,50 +286,46 @@ def try_find_column(df: pd.DataFrame, candidates):
 
 def parse_xlsx(file) -> pd.DataFrame:
     # tenta ler a planilha assumindo colunas óbvias
-    xls = pd.read_excel(file)
-    df = xls.copy()
-    # Procurar colunas prováveis
-    col_prof = try_find_column(df, ["profissional", "nome", "médico", "medico", "professor"])
-    col_data = try_find_column(df, ["data", "dt", "dia"])
-    col_tipo = try_find_column(df, ["tipo", "atendimento", "procedimento", "descricao"])
-    col_qtd = try_find_column(df, ["quantidade", "qtd", "total", "qte"])
+    # 1ª leitura só do cabeçalho para descobrir as colunas relevantes
+    header = pd.read_excel(file, engine="openpyxl", nrows=0)
+    col_prof = try_find_column(header, ["profissional", "nome", "médico", "medico", "professor"])
+    col_data = try_find_column(header, ["data", "dt", "dia"])
+    col_tipo = try_find_column(header, ["tipo", "atendimento", "procedimento", "descricao"])
+    col_qtd = try_find_column(header, ["quantidade", "qtd", "total", "qte"])
 
     # Se não encontrar, tenta adivinhar por posição
-    if col_prof is None and df.shape[1] >= 1:
-        col_prof = df.columns[0]
-    if col_data is None and df.shape[1] >= 2:
-        col_data = df.columns[1]
-    if col_tipo is None and df.shape[1] >= 3:
-        col_tipo = df.columns[2]
-    if col_qtd is None and df.shape[1] >= 4:
-        col_qtd = df.columns[3]
+    if col_prof is None and header.shape[1] >= 1:
+        col_prof = header.columns[0]
+    if col_data is None and header.shape[1] >= 2:
+        col_data = header.columns[1]
+    if col_tipo is None and header.shape[1] >= 3:
+        col_tipo = header.columns[2]
+    if col_qtd is None and header.shape[1] >= 4:
+        col_qtd = header.columns[3]
+
+    # 2ª leitura apenas das colunas usadas, textos sem inferência de tipo
+    if hasattr(file, "seek"):
+        file.seek(0)
+    usecols = list(dict.fromkeys(c for c in (col_prof, col_data, col_tipo, col_qtd) if c is not None))
+    text_cols = {c: str for c in (col_prof, col_tipo) if c is not None}
+    df = pd.read_excel(file, engine="openpyxl", usecols=usecols, dtype=text_cols)
 
     prepared = pd.DataFrame()
     prepared["profissional"] = df[col_prof].astype(str)
-    prepared["data"] = pd.to_datetime(df[col_data], errors="coerce")
+    prepared["data"] = parse_dates(df[col_data])
     prepared["tipo"] = df[col_tipo].astype(str)
-    prepared["quantidade"] = pd.to_numeric(df[col_qtd], errors="coerce").fillna(0).astype(int)
-
-    # separar id e nome se estiver no formato '3321 - NOME'
-    def split_prof(p):
-        if p is None:
-            return (None, "")
-        p = str(p).strip()
-        if "-" in p:
-            parts = p.split("-", 1)
-            return parts[0].strip(), parts[1].strip()
-        return (None, p)
-
-    prof_split = prepared["profissional"].apply(split_prof)
-    prepared["profissional_id"] = prof_split.apply(lambda x: x[0] if x and x[0] != "" else None)
-    prepared["profissional_nome"] = prof_split.apply(lambda x: x[1] if x and x[1] != "" else None)
+    # int32 só economiza memória da coluna
+    prepared["quantidade"] = pd.to_numeric(df[col_qtd], errors="coerce").fillna(0).astype(np.int32)
+
+    # separar id e nome se estiver no formato '3321 - NOME' (regex vetorizada)
+    parts = prepared["profissional"].str.extract(r"^\s*(?:(\d+)\s*-\s*)?(.*?)\s*$")
+    prepared["profissional_id"] = parts[0].where(parts[0].notna() & (parts[0] != ""), None)
 
     # preferir nome extraído quando existir
-    prepared["profissional"] = prepared.apply(lambda r: r["profissional_nome"] if r["profissional_nome"] not in (None, "") else r["profissional"], axis=1)
-    prepared.drop(columns=["profissional_nome"], inplace=True)
+    prepared["profissional"] = parts[1].where(parts[1].notna() & (parts[1] != ""), prepared["profissional"])
 
-    # period (YYYY-MM)
-    prepared["period"] = prepared["data"].dt.to_period("M").astype(str)
+    # period (ano*12 + mês-1)
+    prepared["period"] = period_from_dates(prepared["data"])
 
     prepared = prepared[["profissional_id", "profissional", "data", "tipo", "quantidade", "period"]]
     prepared["source_file"] = getattr(file, "name", "uploaded")
@@ -177,7 +343,7 @@ def parse_pdf_placeholder(file) -> pd.DataFrame:
         "quantidade": [20, 13, 6, 2, 2],
     }
     df = pd.DataFrame(data)
-    df["period"] = df["data"].dt.to_period("M").astype(str)
+    df["period"] = period_from_dates(df["data"])
     df["source_file"] = getattr(file, "name", "uploaded")
     return df
 
@@ -225,6 +391,8 @@ WEIGHTS_NEGATIVOS = {
 
 
 # Mapear o texto do campo 'tipo' do relatório para critérios
+# (poucos tipos distintos se repetem em milhares de linhas -> memoizado)
+@functools.lru_cache(maxsize=4096)
 def map_tipo_para_criterio(tipo_text: str) -> str:
     t = (tipo_text or "").lower()
     if "visita" in t:
@@ -252,6 +420,17 @@ def map_tipo_para_criterio(tipo_text: str) -> str:
     return "outros"
 
 
+# Mapeia uma coluna inteira de 'tipo' (uma chamada por tipo distinto)
+def map_tipos_para_criterios(tipos: pd.Series) -> pd.Series:
+    mapping = {t: map_tipo_para_criterio(t) for t in tipos.dropna().unique()}
+    return tipos.map(mapping).fillna("outros")
+
+
+# Todos os critérios que map_tipo_para_criterio pode devolver (colunas da matriz profissional x critério)
+_CRITERIOS = [*WEIGHTS_POSITIVOS, "pre_natal", "consulta", "outros"]
+_PESOS_CRITERIOS = np.array([WEIGHTS_POSITIVOS.get(crit, 0) for crit in _CRITERIOS])
+
+
 # Calcula pontos positivos a partir de um resumo por critério
 def calcula_pontos_positivos_from_summary(summary_counts: dict) -> int:
     pts = 0
@@ -277,6 +456,22 @@ def classify_points(pontos_final: int) -> str:
     return "Não tem direito"
 
 
+# Mesmas faixas de classify_points, para classificar uma coluna inteira de uma vez
+_CLASSIFY_BINS = np.array([650, 851, 951, 1051, 1151])
+_CLASSIFY_LABELS = np.array([
+    "Não tem direito",
+    "Tem direito - Gratificação Tipo I",
+    "Tem direito - Gratificação Tipo II",
+    "Tem direito - Gratificação Tipo III",
+    "Tem direito - Gratificação Tipo IV",
+    "Tem direito - Gratificação Tipo V",
+])
+
+
+def classify_points_array(pontos_finais) -> np.ndarray:
+    return _CLASSIFY_LABELS[np.digitize(np.asarray(pontos_finais), _CLASSIFY_BINS)]
+
+
 # ---------------------------
 # Inicialização DB
 # ---------------------------
@@ -301,75 +496,98 @@ uploaded_files = st.file_uploader("Envie os relatórios (xlsx ou pdf)", type=["x
 processed = False
 if uploaded_files:
     all_parsed = []
+    new_uploads = {}
+    expected_cols = ["profissional_id", "profissional", "data", "tipo", "quantidade", "period", "source_file"]
+    # hashes já tratados nesta sessão: o uploader mantém os arquivos entre reruns
+    uploads_vistos = st.session_state.setdefault("uploads_vistos", set())
     for f in uploaded_files:
+        # pular arquivos já importados (mesmo conteúdo); avisar só uma vez
+        h = file_hash(f)
+        if h in new_uploads:
+            st.info(f"{f.name} já processado anteriormente; ignorado.")
+            continue
+        if h in uploads_vistos:
+            continue
+        uploads_vistos.add(h)
+        if is_upload_processed(h):
+            st.info(f"{f.name} já processado anteriormente; ignorado.")
+            continue
+        new_uploads[h] = f.name
         df_parsed = parse_report(f)
         # padroniza colunas para salvar
         if not df_parsed.empty:
             # garantir colunas
-            expected_cols = ["profissional_id", "profissional", "data", "tipo", "quantidade", "period", "source_file"]
             for c in expected_cols:
                 if c not in df_parsed.columns:
                     df_parsed[c] = None
-            # salvar no DB
-            try:
-                save_atendimentos(df_parsed[["profissional_id", "profissional", "data", "tipo", "quantidade", "period", "source_file"]])
-            except Exception as e:
-                st.warning(f"Falha ao salvar no DB via to_sql; tentando salvar linha a linha: {e}")
-                with sqlite3.connect(DB_PATH) as conn:
-                    df_parsed.to_sql("atendimentos", conn, if_exists="append", index=False)
-            all_parsed.append(df_parsed)
+            all_parsed.append(df_parsed[expected_cols])
+    if new_uploads:
+        # salvar no DB todos os arquivos (e seus hashes) numa única transação
+        combined = pd.concat(all_parsed, ignore_index=True) if all_parsed else None
+        try:
+            save_atendimentos(combined, uploads=list(new_uploads.items()))
+            st.success(f"{len(all_parsed)} arquivo(s) processado(s) e salvos.")
+        except Exception as e:
+            # a transação já foi desfeita; nada foi gravado, tentar de novo no próximo rerun
+            uploads_vistos.difference_update(new_uploads)
+            st.error(f"Falha ao salvar no DB: {e}")
     processed = True
-    st.success(f"{len(all_parsed)} arquivo(s) processado(s) e salvos.")
 
-# Carregar dados do banco (tudo o que já foi processado)
-all_data = load_atendimentos()
+# Períodos já processados (só os dados do período escolhido são carregados)
+all_periods = load_periods()
+selected_period = None
+df_summary = None
 
-if all_data.empty:
+if not all_periods:
     st.info("Nenhum relatório processado ainda. Faça upload para começar (use o painel acima).")
 else:
     # periodos disponíveis
-    periods = sorted(all_data["period"].dropna().unique())
+    periods = [p for p in all_periods if p is not None]
     if not periods:
         st.info("Não há períodos válidos nos dados. Verifique os uploads.")
     else:
-        selected_period = st.selectbox("Filtrar por período (mês)", periods, index=len(periods) - 1)
+        selected_period = st.selectbox("Filtrar por período (mês)", periods, index=len(periods) - 1, format_func=format_period)
 
-        # filtrar dados para o período
-        data_period = all_data[all_data["period"] == selected_period]
+        # carregar apenas os dados do período
+        data_period = load_atendimentos_cached(get_db_mtime(), selected_period)
 
         # agrupar por profissional e mapear critérios
         def resumo_por_profissional(df):
-            grouped = df.groupby(["profissional_id", "profissional"], dropna=False)
+            columns = ["profissional_id", "profissional", "crit_counts", "pontos_positivos", "pontos_negativos", "pontos_finais", "classificacao"]
+            if df.empty:
+                return pd.DataFrame(columns=columns)
+            # contar por tipo mapeado: soma agrupada (profissional x critério) direto em numpy
+            crit_codes = pd.Categorical(map_tipos_para_criterios(df["tipo"]), categories=_CRITERIOS).codes
+            prof_codes, profs = pd.MultiIndex.from_frame(df[["profissional_id", "profissional"]]).factorize(sort=True)
+            n_crit = len(_CRITERIOS)
+            counts = np.bincount(
+                prof_codes * n_crit + crit_codes,
+                weights=df["quantidade"].to_numpy(dtype=float),
+                minlength=len(profs) * n_crit,
+            ).reshape(len(profs), n_crit).astype(np.int64)
+            pontos_pos_all = counts @ _PESOS_CRITERIOS
+            # descontos já salvos, somados por profissional
+            neg_map = load_descontos_sum_by_period(selected_period)
+
             rows = []
-            for (pid, pnome), g in grouped:
-                # contar por tipo mapeado
-                crit_counts = {}
-                for _, r in g.iterrows():
-                    crit = map_tipo_para_criterio(r["tipo"])
-                    crit_counts[crit] = crit_counts.get(crit, 0) + int(r["quantidade"]) if pd.notnull(r["quantidade"]) else crit_counts.get(crit, 0)
-
-                pontos_pos = calcula_pontos_positivos_from_summary(crit_counts)
-                # carregar descontos já salvos
-                key_id = pid if pid not in (None, "", "None") else pnome
-                descontos_salvos = load_descontos(key_id, selected_period)
-                pontos_neg = sum([v for v in descontos_salvos.values()]) if descontos_salvos else 0
-
-                pontos_final = pontos_pos - pontos_neg
-                classific = classify_points(pontos_final)
+            for (pid, pnome), linha, pontos_pos in zip(profs, counts, pontos_pos_all):
+                crit_counts = {crit: int(cnt) for crit, cnt in zip(_CRITERIOS, linha) if cnt}
+                pontos_pos = int(pontos_pos)
+                key_id = pid if not pd.isna(pid) and pid not in ("", "None") else pnome
+                pontos_neg = int(neg_map.get(key_id) or 0)
 
                 row = {
                     "profissional_id": key_id,
-                    "profissional": pnome if pnome not in (None, "", "None") else key_id,
+                    "profissional": pnome if not pd.isna(pnome) and pnome not in ("", "None") else key_id,
                     "crit_counts": crit_counts,
                     "pontos_positivos": pontos_pos,
                     "pontos_negativos": pontos_neg,
-                    "pontos_finais": pontos_final,
-                    "classificacao": classific,
                 }
                 rows.append(row)
-            if rows:
-                return pd.DataFrame(rows)
-            return pd.DataFrame(columns=["profissional_id", "profissional", "crit_counts", "pontos_positivos", "pontos_negativos", "pontos_finais", "classificacao"])
+            summary = pd.DataFrame(rows)
+            summary["pontos_finais"] = summary["pontos_positivos"] - summary["pontos_negativos"]
+            summary["classificacao"] = classify_points_array(summary["pontos_finais"])
+            return summary[columns]
 
         df_summary = resumo_por_profissional(data_period)
 
@@ -383,15 +601,19 @@ else:
 
             st.markdown("---")
             st.markdown("### Ações")
-            # lista compacta com botões de ação por linha (coluna Ações)
-            for idx, row in df_summary.iterrows():
-                cols = st.columns([6, 1])
-                cols[0].markdown(f"**{row['profissional']}** — Pontos: **{row['pontos_finais']}** — {row['classificacao']}")
-                if cols[1].button("Detalhes", key=f"det_{row['profissional_id']}_{selected_period}"):
-                    st.session_state["view_prof"] = row["profissional_id"]
-                    st.session_state["view_period"] = selected_period
-                    st.session_state["page"] = "detalhe"
-                    st.rerun()
+            # um único seletor + botão em vez de um botão por profissional
+            # chave = índice da linha: o resumo agrupa por (id, nome), então ids podem se repetir
+            labels = {
+                idx: f"{row['profissional_id']} — {row['profissional']} — Pontos: {row['pontos_finais']} — {row['classificacao']}"
+                for idx, row in df_summary.to_dict("index").items()
+            }
+            idx_sel = st.selectbox("Profissional para detalhes", list(labels), format_func=labels.get, key=f"sel_prof_{selected_period}")
+            if st.button("Detalhes"):
+                row_sel = df_summary.loc[idx_sel]
+                st.session_state["view_prof"] = row_sel["profissional_id"]
+                st.session_state["view_period"] = selected_period
+                st.session_state["page"] = "detalhe"
+                st.rerun()
 
 # ---------------------------
 # Página de detalhe (quando acionada)
@@ -400,24 +622,28 @@ if st.session_state.get("page") == "detalhe":
     prof_id = st.session_state.get("view_prof")
     period = st.session_state.get("view_period")
     # recuperar registros do periodo
-    df_prof = all_data[(all_data["profissional_id"] == prof_id) | (all_data["profissional"] == prof_id)]
-    df_prof = df_prof[df_prof["period"] == period]
+    data_period = load_atendimentos_cached(get_db_mtime(), period)
+    df_prof = data_period[(data_period["profissional_id"] == prof_id) | (data_period["profissional"] == prof_id)]
     if df_prof.empty:
         st.warning("Dados do profissional não encontrados para o período.")
     else:
-        st.header(f"Detalhes: {prof_id} — Período: {period}")
+        st.header(f"Detalhes: {prof_id} — Período: {format_period(period)}")
         st.dataframe(df_prof[["data", "tipo", "quantidade", "source_file"]], use_container_width=True)
 
-        # calcular resumo por critério
-        crit_counts = {}
-        for _, r in df_prof.iterrows():
-            crit = map_tipo_para_criterio(r["tipo"])
-            crit_counts[crit] = crit_counts.get(crit, 0) + int(r["quantidade"]) if pd.notnull(r["quantidade"]) else crit_counts.get(crit, 0)
+        # resumo por critério vem do df_summary desta execução (mesmos grupos que df_prof);
+        # recalcula só se a lista mostra outro período
+        if df_summary is not None and selected_period == period:
+            grupos = df_summary[(df_summary["profissional_id"] == prof_id) | (df_summary["profissional"] == prof_id)]
+            crit_counts = dict(sum((Counter(c) for c in grupos["crit_counts"]), Counter()))
+            pontos_pos = int(grupos["pontos_positivos"].sum())
+        else:
+            criterios = map_tipos_para_criterios(df_prof["tipo"])
+            crit_counts = df_prof.groupby(criterios)["quantidade"].sum().astype(int).to_dict()
+            pontos_pos = calcula_pontos_positivos_from_summary(crit_counts)
 
         st.subheader("✅ Pontos Positivos (contagens)")
         st.json(crit_counts)
 
-        pontos_pos = calcula_pontos_positivos_from_summary(crit_counts)
         st.write(f"**Pontos positivos (calculados):** {pontos_pos}")
 
         # carregar descontos salvos e permitir edição
@@ -465,6 +691,14 @@ with st.expander("🔧 Developer tests (executar)"):
         st.write("Pontos calculados:", pts)
         st.write("Classificação para esse total:", classify_points(pts))
 
+        st.write("-> Teste: datas ISO e dd/mm/aaaa")
+        sample_dates = pd.Series(["2025-03-04", "2025-03-21", "21/03/2025", "04/03/2025", "2025-03-05 10:30:00"])
+        parsed_dates = parse_dates(sample_dates).dt.strftime("%Y-%m-%d").tolist()
+        expected_dates = ["2025-03-04", "2025-03-21", "2025-03-21", "2025-03-04", "2025-03-05"]
+        st.write("Datas lidas:", parsed_dates)
+        if parsed_dates != expected_dates:
+            st.error(f"Datas incorretas; esperado {expected_dates}")
+
         st.write("-> Teste: parse placeholder (PDF)")
         sample_pdf_df = parse_pdf_placeholder(type("F", (), {"name": "sample.pdf"})())
         st.dataframe(sample_pdf_df)